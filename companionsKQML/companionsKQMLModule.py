@@ -11,46 +11,171 @@
 agents. Adds a KQML socket server that is kept alive in a thread for
 continuous communication between Companions and your python agents.
 
+Modules that are slow to import or only exist on some platforms (psutil,
+dateutil, ipaddress and ctypes, whose windll is windows only) are imported
+inside the functions that use them, rather than here.
+
 Attributes:
+    COMPANIONS_CACHE (dict): the last unverified check_for_companions result,
+        a (monotonic time, port) tuple under 'port'
+    COMPANIONS_CACHE_TTL (float): seconds a cached check_for_companions
+        result is reused for
+    COMPANIONS_COMMS (dict): COMPANIONS_TARGETS as they appear (lowercased)
+        in /proc/<pid>/comm on linux, truncated to 15 characters -> name
     COMPANIONS_EXES (list): list of common companions executable names
+    COMPANIONS_NAMES (dict): lowercased COMPANIONS_TARGETS -> name, process
+        names are compared case insensitively
+    COMPANIONS_TARGETS (frozenset): every process name check_for_companions
+        searches for, the companions executables and allegro
+    DISK_DRIVE_TYPES (frozenset): GetDriveType results for the drives
+        searched for a qrg directory (removable and fixed, windows)
+    DISPATCH_EXECUTOR (ThreadPoolExecutor): pool every agent's listener runs
+        its dispatchers in, with DISPATCH_POOL_SIZE threads
+    DISPATCH_POOL_SIZE (int): threads in the DISPATCH_EXECUTOR, from the
+        COMPANIONS_THREAD_POOL_SIZE environment variable (32 by default, or
+        if it isn't a positive integer)
+    DOT (KQMLToken): the '.' of a dotted pair
+    FILE_NOTIFY_CHANGE_FILE_NAME (int): windows change notification filter,
+        a file was created, renamed or deleted
+    FILE_NOTIFY_CHANGE_LAST_WRITE (int): windows change notification filter,
+        a file was written
+    IN_CLOEXEC (int): inotify_init1 flag, close the watch on exec
+    IN_CLOSE_WRITE (int): inotify event, a file opened for writing was closed
+    IN_MOVED_TO (int): inotify event, a file was moved into the directory
+    INFINITE (int): WaitForSingleObject timeout, wait forever (windows)
+    IPV4_OCTET (str): regex for a single (0-255) octet of an ip4 address
+    IPV4_PATTERN (Pattern): compiled regex matching a full ip4 address
     KQMLType (TypeVar): simplified type for KQML, includes list, tokens, and
         strings
+    LISTIFY_ATOMS (dict): type -> function converting an object of that type
+        (that isn't broken down into items) to KQML, used by listify
+    LISTIFY_ITEMS (dict): type -> function giving the items of an object of
+        that type to be listified into a KQMLList (or None), used by listify
     LOCALHOST (str): 'localhost'
-    LOCALHOST_DEFS (list): list of common localhost equivalents
+    LOCALHOST_DEFS (frozenset): set of common localhost equivalents
     LOGGER (logging): The logger (from logging) to handle debugging
+    NEW_PROCESS_GROUP (dict): Popen kwargs to launch a process in its own
+        process group (windows) or session (everywhere else)
+    NIL (KQMLToken): lisp false/ empty list, 'nil'
+    OCTAL_ESCAPE (Pattern): compiled regex for the octal escapes in
+        /proc/mounts
     PORTNUM (str): 'portnum.dat' - name of file generated by Companions on
         startup of it's own KQML socket server
+    PORTNUM_FIELDS (Pattern): compiled regex for the integer fields of a
+        portnum.dat line, None when orjson (faster still) is installed
+    PORTNUM_PATH_CACHE (Path): file (relative to the home directory) caching
+        the location of the portnum.dat file of the last companion found
+    PORT_DICT_CACHE (dict): maps portnum.dat paths to the (inode, mtime, size)
+        the file had when read and the port dictionary read from it
+    QRG_ROOT_CACHE (Path): file (relative to the home directory) caching the
+        location of the qrg directory between runs
+    QRG_ROOT_VARIABLES (tuple): environment variables that can be set to the
+        qrg directory, checked in order before searching for it
+    SEND_BUFFERS (local): per thread buffers for serializing outgoing messages
+    TRUE (KQMLToken): lisp true, 't'
+    WAIT_OBJECT_0 (int): WaitForSingleObject result, the object was signaled
+        (windows)
 """
 
 from argparse import ArgumentParser, ArgumentTypeError
+from asyncio import new_event_loop, AbstractEventLoop, CancelledError
 from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from datetime import datetime
-from io import BufferedReader, BufferedWriter
-from ipaddress import ip_address
-from json import loads as load_dict
+from functools import lru_cache
+from io import BufferedReader, BytesIO
+from itertools import islice
 from logging import getLogger, DEBUG, INFO
+from os import environ, listdir, readlink, read, close, stat, fsencode, \
+     fsdecode, open as open_fd, O_RDONLY
+from os.path import exists as path_exists, isdir, join as join_path
 from pathlib import Path
+from re import compile as compile_regex
+from select import select
 from socket import socket, SocketIO, gethostname, SOL_SOCKET, SO_REUSEADDR, \
-     SHUT_RDWR
-from subprocess import Popen
-from sys import argv as system_argument_list
-from threading import Thread
-from time import sleep
-from typing import Optional, Any, TypeVar
+     SHUT_RDWR, IPPROTO_TCP, TCP_NODELAY
+try:
+    from socket import TCP_QUICKACK
+except ImportError:  # linux only
+    TCP_QUICKACK = None
+from string import ascii_uppercase
+from struct import unpack_from
+from subprocess import Popen, DEVNULL
+from sys import argv as system_argument_list, platform
+from threading import Thread, Lock, local
+from time import sleep, monotonic
+from typing import Optional, Any, Callable, TypeVar, Iterator, Iterable, \
+     NamedTuple
 # non-system, pip installs
-from dateutil.relativedelta import relativedelta
 from kqml import KQMLModule, KQMLReader, KQMLPerformative, KQMLList, \
      KQMLDispatcher, KQMLToken, KQMLString
-from psutil import disk_partitions, process_iter
+try:  # optional, faster json parsing
+    from orjson import loads as load_dict
+    PORTNUM_FIELDS = None
+except ImportError:
+    from json import loads as load_dict
+    # the json module is slower than a regex on the two integer fields
+    PORTNUM_FIELDS = compile_regex(rb'"(port|pid)"\s*:\s*(\d+)')
 
 PORTNUM = 'portnum.dat'
 LOCALHOST = 'localhost'
-LOCALHOST_DEFS = [LOCALHOST, '127.0.0.1', '::1']
+LOCALHOST_DEFS = frozenset((LOCALHOST, '127.0.0.1', '::1'))
+IPV4_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+IPV4_PATTERN = compile_regex(rf'{IPV4_OCTET}(?:\.{IPV4_OCTET}){{3}}')
+OCTAL_ESCAPE = compile_regex(r'\\([0-7]{3})')
+QRG_ROOT_CACHE = Path('.cache', 'companionsKQML', 'qrg_root')
+QRG_ROOT_VARIABLES = ('QRG_ROOT', 'COMPANIONS_HOME')
+PORTNUM_PATH_CACHE = Path('.cache', 'companionsKQML', 'portnum_path')
+if platform == 'win32':
+    from subprocess import CREATE_NEW_PROCESS_GROUP
+    NEW_PROCESS_GROUP = {'creationflags': CREATE_NEW_PROCESS_GROUP}
+else:
+    NEW_PROCESS_GROUP = {'start_new_session': True}
 COMPANIONS_EXES = ['CompanionsMicroServer64.exe', 'CompanionsServer64.exe']
+COMPANIONS_TARGETS = frozenset((*COMPANIONS_EXES, 'allegro.exe'))
+COMPANIONS_NAMES = {name.lower(): name for name in COMPANIONS_TARGETS}
+# the kernel truncates comm to 15 characters (TASK_COMM_LEN - 1)
+COMPANIONS_COMMS = {name[:15]: target
+                    for name, target in COMPANIONS_NAMES.items()}
+DISK_DRIVE_TYPES = frozenset((2, 3))  # DRIVE_REMOVABLE, DRIVE_FIXED
 KQMLType = TypeVar('KQML_TYPE', KQMLList, KQMLToken, KQMLString)
+SEND_BUFFERS = local()
+DOT = KQMLToken('.')
+TRUE = KQMLToken('t')
+NIL = KQMLToken('nil')
+# inotify(7) flags, used to wait on the portnum.dat file
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+# FindFirstChangeNotification filters and WaitForSingleObject values (windows)
+FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
+FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
+INFINITE = 0xFFFFFFFF
+WAIT_OBJECT_0 = 0
+# seconds a check_for_companions result is reused for
+COMPANIONS_CACHE_TTL = 2.0
+COMPANIONS_CACHE = {}
+PORT_DICT_CACHE = {}
 
 LOGGER = getLogger(__name__)
 
+# dispatchers spend most of their time blocked reading a socket, so the pool
+# is sized past the number of connections Companions holds open at once
+# rather than by cpu count
+DISPATCH_POOL_SIZE = 32
+try:
+    DISPATCH_POOL_SIZE = int(environ.get('COMPANIONS_THREAD_POOL_SIZE',
+                                         DISPATCH_POOL_SIZE))
+    if DISPATCH_POOL_SIZE < 1:
+        raise ValueError(DISPATCH_POOL_SIZE)
+except ValueError:
+    LOGGER.warning('COMPANIONS_THREAD_POOL_SIZE must be a positive integer, '
+                   'got %r; using 32 threads',
+                   environ['COMPANIONS_THREAD_POOL_SIZE'])
+    DISPATCH_POOL_SIZE = 32
+DISPATCH_EXECUTOR = ThreadPoolExecutor(max_workers=DISPATCH_POOL_SIZE,
+                                       thread_name_prefix='kqml-dispatch')
+
 
 ###############################################################################
 #                  Modified KQMLModule with threaded server                   #
@@ -71,10 +196,14 @@ class CompanionsKQMLModule(KQMLModule):
         host (str): The host of Companions (localhost or an ip address)
         listen_socket (socket): Socket object the listener will control,
             receives incoming messages from Companions
+        accept_task (Task): the accept_connections task run by the listener,
+            cancelled (from any thread) to stop accepting connections
+        listen_loop (AbstractEventLoop): event loop the listener accepts
+            connections on
         listener (Thread): Thread running the socket listening loop, calls the
             dispatcher as well.
         listener_port (int): port number you want to host the listener on
-        local_out (BufferedWriter): Connection to the listener socker server
+        local_out (socket): Connection to the listener socker server
            output, used to send messages on the listener port for Companions
            to pick up on.
         name (str): Name of this agent (module), used in registration so this
@@ -83,13 +212,20 @@ class CompanionsKQMLModule(KQMLModule):
             same type of agent.
         num_subs (int): The number of subscriptions that the agent has (only
             used later in Pythonian)
-        out (BufferedWriter): Connection to the Companions KQML socket server,
-            created from send_socket, used by send
+        out (socket): Connection to the Companions KQML socket server, the
+            connected send_socket, used by send
+        ping_template (KQMLPerformative): prebuilt update sent in reply to a
+            ping, copied and filled in by ping_update
         port (int): port number that Companions is hosted on
         ready (bool): Boolean that controls the threads looping, overwrites the
             ready function from KQMLModule
+        registration (KQMLPerformative): prebuilt registration message, sent
+            by register
         reply_id_counter (int): From KQMLModule, used in send_with_continuation
             adds reply-with and the appropriate reply id
+        send_lock (Lock): Lock held while sending a message, send_socket and
+            out are replaced on every send and messages are sent from several
+            threads (dispatchers, pollers, etc)
         send_socket (socket): Socket that will connect to Companions for
             sending messages. Need to keep track of it to properly close itself
             initializes to None and only has a socket after calling connect
@@ -97,6 +233,8 @@ class CompanionsKQMLModule(KQMLModule):
             updating running status in Companions
         state (str): the state this agent is in, used for updating running
             status in Companions
+        uptime_cache (tuple): (monotonic time, uptime string) of the last
+            uptime computed, reused for up to a second
     """
 
     name = 'CompanionsKQMLModule'
@@ -116,19 +254,23 @@ class CompanionsKQMLModule(KQMLModule):
             debug (bool, optional): Whether to set the level of the logger to
                 DEBUG or INFO - silencing debug errors and only showing needed
                 information.
+
+        Raises:
+            ValueError: host isn't a valid ip address or either port isn't a
+                valid port number
         """
         # OUTPUTS
-        assert valid_ip(host), 'Host must be local or a valid ip address'
-        self.host = host
-        assert valid_port(port), \
-            'port must be valid port number (1024-65535)'
-        self.port = port
+        self.host = validated(valid_ip, host,
+                              'Host must be local or a valid ip address')
+        self.port = validated(valid_port, port,
+                              'port must be valid port number (1024-65535)')
         self.send_socket = None
         self.out = None
+        self.send_lock = Lock()
         # INPUTS
-        assert valid_port(listener_port), \
-            'listener_port must be a valid port number (1024-65535)'
-        self.listener_port = listener_port
+        self.listener_port = validated(
+            valid_port, listener_port,
+            'listener_port must be a valid port number (1024-65535)')
         self.dispatcher = None
         self.listen_socket = socket()
         self.listen_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
@@ -136,11 +278,16 @@ class CompanionsKQMLModule(KQMLModule):
         self.listen_socket.listen(10)
         self.local_out = None
         self.ready = True
+        # created up front so exit can stop it before the listener is running
+        self.listen_loop = new_event_loop()
+        self.accept_task = self.listen_loop.create_task(
+            self.accept_connections(self.listen_loop))
         self.listener = Thread(target=self.listen, args=[])
         # FROM KQMLModule
         self.reply_id_counter = 1
         # UPDATES
         self.starttime = datetime.now()
+        self.uptime_cache = (0.0, None)
         self.state = 'idle'
         self.num_subs = 0
         # LOGGING / DEBUG
@@ -149,6 +296,17 @@ class CompanionsKQMLModule(KQMLModule):
             LOGGER.setLevel(DEBUG)
         else:
             LOGGER.setLevel(INFO)
+        # PREBUILT MESSAGES (parsed once, copied/updated when sent)
+        self.registration = performative(
+            f'(register :sender {self.name} :receiver facilitator :content '
+            f'("socket://{self.host}:{self.listener_port}" nil nil '
+            f'{self.listener_port}))'
+        )
+        self.ping_template = performative(
+            f'(update :sender {self.name} :content (:agent {self.name} '
+            f':uptime nil :status :OK :state nil :machine {gethostname()} '
+            f':subscriptions 0))'
+        )
         # REGISTER AND START LISTENING
         LOGGER.info('Starting listener (KQML socket server)...')
         self.listener.start()
@@ -232,6 +390,9 @@ class CompanionsKQMLModule(KQMLModule):
         if not argv:
             argv = system_argument_list
         _, *args = argv  # ignore name of file...
+        port = port_only_argument(args)
+        if port:  # common case, no need to build the full parser
+            return cls(port=port)
         parser = ArgumentParser(description='Run Pythonian agent.')
         parser.add_argument('-u', '--url', type=valid_ip,
                             help='url where companions kqml server is hosted')
@@ -263,8 +424,8 @@ class CompanionsKQMLModule(KQMLModule):
         try:
             self.send_socket = socket()
             self.send_socket.connect((self.host, self.port))
-            socket_write = SocketIO(self.send_socket, 'w')
-            self.out = BufferedWriter(socket_write)
+            disable_tcp_delays(self.send_socket)
+            self.out = self.send_socket
         except OSError as error_msg:
             LOGGER.error('Connection failed: %s', error_msg)
         # Verify that you can send messages...
@@ -273,17 +434,22 @@ class CompanionsKQMLModule(KQMLModule):
 
     def send(self, msg: KQMLPerformative):
         """Override of send from KQMLModule, opens and closes socket around
-        send for proper signaling to Companions
+        send for proper signaling to Companions (Companions reads a message
+        until the connection is closed, so the socket can't be reused). Sends
+        are serialized with send_lock.
 
         Args:
             msg (KQMLPerformative): message that you are sending to Companions
         """
-        self.connect()
-        self.send_generic(msg, self.out)
-        self.send_socket.shutdown(SHUT_RDWR)
-        self.send_socket.close()
-        self.send_socket = None
-        self.out = None
+        with self.send_lock:
+            self.connect()
+            try:
+                self.send_generic(msg, self.out)
+            finally:
+                self.send_socket.shutdown(SHUT_RDWR)
+                self.send_socket.close()
+                self.send_socket = None
+                self.out = None
 
     def send_on_local_port(self, msg: KQMLPerformative):
         """Sends a message on the local_out, i.e. sends a message on the
@@ -312,22 +478,27 @@ class CompanionsKQMLModule(KQMLModule):
         self.send_on_local_port(reply_msg)
 
     @staticmethod
-    def send_generic(msg: KQMLPerformative, out: BufferedWriter):
-        """Basic send mechanism copied (more or less) from pykqml. Writes the
-        msg as a string to the output buffer then flushes it.
+    def send_generic(msg: KQMLPerformative, out: socket):
+        """Basic send mechanism copied (more or less) from pykqml. Serializes
+        the msg (and the trailing newline) first, then sends it on the socket
+        in one piece - no buffered writer to copy it into and flush. The
+        buffer is sent through a view of it rather than a copy (getvalue),
+        which matters for large query results.
 
         Args:
             msg (KQMLPerformative): Message to be sent
-            out (BufferedWriter): The output to write to, needed for sending to
+            out (socket): The socket to send on, needed for sending to
                 Companions and sending on our own port.
         """
         LOGGER.debug('Sending: %s', msg)
+        message = send_buffer()
+        msg.write(message)
+        message.write(b'\n')
         try:
-            msg.write(out)
+            with message.getbuffer() as view:
+                out.sendall(view)
         except IOError:
             LOGGER.error('IOError during message sending')
-        out.write(b'\n')
-        out.flush()
 
     # INPUT FUNCTIONS (OVERRIDE AND ADDITION):
 
@@ -337,23 +508,45 @@ class CompanionsKQMLModule(KQMLModule):
 
         Doesn't necessarily need threading; Could just start dispatcher and
         after it returns accept next connection. This couldn't handle loads of
-        inputs while being bogged down processing. To avoid this issue we
-        thread the dispatching so the functions that get called are run in a
-        separate Thread. We're using ThreadPoolExecutor because sockets use io,
-        io is blocking and threads allow you to not block.
+        inputs while being bogged down processing. To avoid this issue the
+        connections are accepted on an asyncio event loop (in this listener
+        Thread) and each dispatcher - a blocking read loop from pykqml - is
+        run in the DISPATCH_EXECUTOR (shared by every agent in the process),
+        so the functions that get called are run in a separate Thread. Runs
+        until the accept_task is cancelled (see exit).
+        """
+        self.listen_socket.setblocking(False)  # required by sock_accept
+        try:
+            self.listen_loop.run_until_complete(self.accept_task)
+        finally:
+            self.listen_loop.close()
+
+    async def accept_connections(self, loop: AbstractEventLoop):
+        """Accepts connections on the listen_socket (while ready) and starts a
+        dispatcher on each of them in the DISPATCH_EXECUTOR.
+
+        Args:
+            loop (AbstractEventLoop): the event loop this is running on
         """
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            while self.ready:
-                connection, _ = self.listen_socket.accept()
-                LOGGER.debug('Received connection: %s', connection)
-                socket_write = SocketIO(connection, 'w')
-                self.local_out = BufferedWriter(socket_write)
-                socket_read = SocketIO(connection, 'r')
-                read_input = KQMLReader(BufferedReader(socket_read))
-                self.dispatcher = KQMLDispatcher(self, read_input, self.name)
-                LOGGER.debug('Starting dispatcher: %s', self.dispatcher)
-                executor.submit(self.dispatcher.start)
-                self.state = 'dispatching'
+        while self.ready:
+            try:
+                connection, _ = await loop.sock_accept(self.listen_socket)
+            except CancelledError:  # exit
+                return
+            connection.setblocking(True)  # pykqml reads are blocking
+            disable_tcp_delays(connection)
+            LOGGER.debug('Received connection: %s', connection)
+            self.local_out = connection
+            socket_read = SocketIO(connection, 'r')
+            read_input = PooledKQMLReader.get(BufferedReader(socket_read))
+            self.dispatcher = PooledKQMLDispatcher.get(self, read_input,
+                                                       self.name)
+            LOGGER.debug('Starting dispatcher: %s', self.dispatcher)
+            # not the loop's default executor, closing the loop would shut the
+            # shared pool down
+            loop.run_in_executor(DISPATCH_EXECUTOR, run_dispatcher,
+                                 self.dispatcher)
+            self.state = 'dispatching'
 
     def receive_eof(self):
         """Override of KQMLModule, shuts down the dispatcher after receiving
@@ -374,29 +567,40 @@ class CompanionsKQMLModule(KQMLModule):
 
     def exit(self, n: int = 0):
         """Override of KQMLModule; Closes this agent, shuts down the threaded
-        execution loop (by turning off the ready flag), shuts the dispatcher
-        down (if running), and then joins any running threads...
+        execution loop (by turning off the ready flag and cancelling the
+        accept_task - waking the listener's event loop straight away, rather
+        than leaving it blocked until the next connection), shuts the
+        dispatcher down (if running, by shutting its connection down so the
+        read it is blocked in returns eof), and then joins any running
+        threads...
 
         Args:
             n (int, optional): the value to pass along to sys.exit
         """
         LOGGER.info('Shutting down agent: %s', self.name)
-        self.ready = False  # may need to wait for threads to stop...
+        self.ready = False
+        try:
+            self.listen_loop.call_soon_threadsafe(self.accept_task.cancel)
+        except RuntimeError:  # loop already closed, the listener is done
+            pass
         if self.dispatcher is not None:
-            self.dispatcher.shutdown()
+            # the dispatcher's blocked read returns eof and it shuts itself
+            # down (receive_eof), closing its reader from here would wait on
+            # the lock that read holds - and once released the dispatcher
+            # may already be serving another agent
+            try:
+                self.local_out.shutdown(SHUT_RDWR)
+            except OSError:  # already closed by the other end
+                pass
         self.listener.join()
+        self.listen_socket.close()
 
     # COMPANIONS SPECIFIC OVERRIDES:
 
     def register(self):
         """Override of KQMLModule, registers this agent with Companions"""
         LOGGER.info('Registering...')
-        registration = (
-            f'(register :sender {self.name} :receiver facilitator :content '
-            f'("socket://{self.host}:{self.listener_port}" nil nil '
-            f'{self.listener_port}))'
-        )
-        self.send(performative(registration))
+        self.send(self.registration)
 
     def receive_other_performative(self, msg: KQMLPerformative):
         """Override of KQMLModule default... ping isn't currently supported by
@@ -408,12 +612,7 @@ class CompanionsKQMLModule(KQMLModule):
         """
         if msg.head() == 'ping':
             LOGGER.info('Receive ping... %s', msg)
-            reply_content = (
-                f'(update :sender {self.name} :content (:agent {self.name} '
-                f':uptime {self.uptime()} :status :OK :state {self.state} '
-                f':machine {gethostname()} :subscriptions {self.num_subs}))'
-            )
-            self.reply_on_local_port(msg, performative(reply_content))
+            self.reply_on_local_port(msg, self.ping_update())
         else:
             self.error_reply(msg, f'unexpected performative: {msg}')
 
@@ -423,9 +622,26 @@ class CompanionsKQMLModule(KQMLModule):
 
     # HELPERS:
 
+    def ping_update(self) -> KQMLPerformative:
+        """Fills in a copy of the prebuilt ping update with the current
+        uptime, state and number of subscriptions (the template itself is left
+        untouched since replying sets the receiver on the message).
+
+        Returns:
+            KQMLPerformative: update to reply to a ping with
+        """
+        content = KQMLList(self.ping_template.get('content').data)
+        content.set('uptime', listify(self.uptime()))
+        content.set('state', token(self.state))
+        content.set('subscriptions', str(self.num_subs))
+        update = KQMLPerformative(KQMLList(self.ping_template.data.data))
+        update.set('content', content)
+        return update
+
     def uptime(self) -> str:
         """Cyc-style time since start. Using the python-dateutil library to do
-        simple relative delta calculations for the uptime.
+        simple relative delta calculations for the uptime. The result only
+        has second resolution, so it is recomputed at most once a second.
 
         Returns:
             str: string of the form
@@ -433,10 +649,17 @@ class CompanionsKQMLModule(KQMLModule):
                  where years, months, days, etc are the uptime in number of
                  years, months, days, etc.
         """
-        time_list = ['years', 'months', 'days', 'hours', 'minutes', 'seconds']
+        now = monotonic()
+        cached_at, cached_uptime = self.uptime_cache
+        if cached_uptime is not None and now - cached_at < 1.0:
+            return cached_uptime
+        from dateutil.relativedelta import relativedelta
         diff = relativedelta(datetime.now(), self.starttime)
-        time_diffs = [getattr(diff, time_period) for time_period in time_list]
-        return f'({" ".join(map(str, time_diffs))})'
+        uptime = '(%d %d %d %d %d %d)' % (diff.years, diff.months, diff.days,
+                                          diff.hours, diff.minutes,
+                                          diff.seconds)
+        self.uptime_cache = (now, uptime)
+        return uptime
 
     def response_to_query(self, msg: KQMLPerformative,
                           content: KQMLPerformative, results: Any,
@@ -463,26 +686,27 @@ class CompanionsKQMLModule(KQMLModule):
         LOGGER.debug('Responding to query: %s, %s, %s', msg, content, results)
         response_type = response_type is None or response_type == ':pattern'
         reply_content = KQMLList(content.head())
+        append = reply_content.append
         results_list = results if isinstance(results, list) else [results]
+        last_result = len(results_list) - 1
         result_index = 0
-        arg_len = len(content.data[1:])
-        for i, each in enumerate(content.data[1:]):
+        arg_len = len(content.data) - 1
+        # islice rather than a slice, no copy of the arguments
+        for i, each in enumerate(islice(content.data, 1, None)):
             # if argument is a variable, replace in the pattern or bind
-            if str(each[0]) == '?':
+            if is_variable(each):
                 # if last argument and there's still more in results
-                if i == arg_len and result_index < len(results_list)-1:
+                if i == arg_len and result_index < last_result:
                     pattern = results_list[result_index:]  # get remaining list
                 else:
                     pattern = results_list[result_index]
                 reply_with = pattern if response_type else (each, pattern)
-                reply_content.append(listify(reply_with))
+                append(listify(reply_with))
                 result_index += 1
             # if not a variable, replace in the pattern. Ignore for bind
             elif response_type:
-                reply_content.append(each)
-        # no need to wrap reply_content in parens, KQMLList will do that for us
-        reply_msg = f'(tell :sender {self.name} :content {reply_content})'
-        self.reply(msg, performative(reply_msg))
+                append(each)
+        self.reply(msg, tell(self.name, reply_content))
 
 
 ###############################################################################
@@ -499,7 +723,8 @@ class ControlledCompanionsKQMLModule(CompanionsKQMLModule):
 
     # TODO: need default for exe_path
     def __init__(self, exe_path: str, exe_name: str = COMPANIONS_EXES[0],
-                 verify_port: bool = True, **kwargs):
+                 verify_port: bool = True, startup_timeout: float = 300,
+                 **kwargs):
         """Launches a companions exe and uses that for connecting to Companions
 
         Args:
@@ -508,17 +733,39 @@ class ControlledCompanionsKQMLModule(CompanionsKQMLModule):
             verify_port (bool, optional): Whether or not to verify that the
                 port associated with your Companion is the one just opened on
                 the exe
+            startup_timeout (float, optional): seconds to wait for the exe to
+                publish its port (portnum.dat) before giving up on it
             **kwargs: the remaining kwargs to be passes to CompanionsKQMLModule
+
+        Raises:
+            TimeoutError: the exe didn't publish its port in startup_timeout
         """
         exe_path = Path(exe_path)
         portnum_path = exe_path / PORTNUM
         exe_location = exe_path / exe_name
-        if portnum_path.exists():  # not needed in Python 3.8
-            portnum_path.unlink()  # missing_ok key handles nonexistant files
-        self.companions_process = Popen(str(exe_location))
-        LOGGER.info('Launched companions: %s', self.companions_process)
-        while not portnum_path.exists():
-            sleep(1)
+        try:  # unlink(missing_ok=True) in Python 3.8
+            portnum_path.unlink()
+        except FileNotFoundError:
+            pass
+        # The exe has no way to be handed a pipe (or other fd) to report its
+        # port on, portnum.dat is the only channel it publishes the port to.
+        # Watch for it before launching so the write can't be missed.
+        with FileWatch(portnum_path) as portnum_watch:
+            # don't share our stdio or console/ process group (ctrl+c) with it
+            self.companions_process = Popen(
+                str(exe_location), stdin=DEVNULL, stdout=DEVNULL,
+                stderr=DEVNULL, close_fds=True, **NEW_PROCESS_GROUP)
+            LOGGER.info('Launched companions: %s', self.companions_process)
+            try:
+                if not portnum_watch.wait(startup_timeout):
+                    raise TimeoutError(f'{exe_location} did not write '
+                                       f'{PORTNUM} within {startup_timeout} '
+                                       f'seconds')
+            except BaseException:
+                # it's in its own session/ process group, nothing else will
+                # stop it
+                self.companions_process.terminate()
+                raise
         kwargs['port'] = get_port(portnum_path, self.companions_process.pid,
                                   verify_port)
         super().__init__(**kwargs)
@@ -576,16 +823,156 @@ class ControlledCompanionsKQMLModule(CompanionsKQMLModule):
             self.companions_process.terminate()
 
 
+###############################################################################
+#                      Reusable readers and send buffers                      #
+###############################################################################
+
+class PooledKQMLReader(KQMLReader):
+    """KQMLReader that can be rebound to a new stream, so that readers are
+    reused across connections (Companions opens a new connection for nearly
+    every message) rather than built for each one.
+
+    Attributes:
+        pool (deque): readers not currently bound to a connection
+    """
+
+    pool = deque()
+
+    @classmethod
+    def get(cls, reader: BufferedReader):
+        """Gets a reader from the pool (or a new one if the pool is empty)
+        bound to the given stream.
+
+        Args:
+            reader (BufferedReader): the stream to read KQML from
+
+        Returns:
+            PooledKQMLReader
+        """
+        try:
+            kqml_reader = cls.pool.pop()
+        except IndexError:
+            return cls(reader)
+        kqml_reader.reset(reader)
+        return kqml_reader
+
+    def reset(self, reader: BufferedReader):
+        """Rebinds this reader to a new stream.
+
+        Args:
+            reader (BufferedReader): the stream to read KQML from
+        """
+        self.reader = reader
+        self.inbuf = ''
+
+    def release(self):
+        """Returns this reader to the pool, drops the stream it was bound to"""
+        self.reset(None)
+        self.pool.append(self)
+
+    def close(self):
+        """Override of KQMLReader, closes the stream (if still bound to one)"""
+        if self.reader is not None:
+            self.reader.close()
+
+
+class PooledKQMLDispatcher(KQMLDispatcher):
+    """KQMLDispatcher that can be rebound to a new reader, reused across
+    connections the same way as PooledKQMLReader.
+
+    Attributes:
+        pool (deque): dispatchers not currently running
+    """
+
+    pool = deque()
+
+    @classmethod
+    def get(cls, receiver: KQMLModule, reader: PooledKQMLReader,
+            agent_name: str):
+        """Gets a dispatcher from the pool (or a new one if the pool is
+        empty) bound to the given receiver and reader.
+
+        Args:
+            receiver (KQMLModule): the agent messages are dispatched to
+            reader (PooledKQMLReader): the reader to dispatch messages from
+            agent_name (str): name of the agent
+
+        Returns:
+            PooledKQMLDispatcher
+        """
+        try:
+            dispatcher = cls.pool.pop()
+        except IndexError:
+            return cls(receiver, reader, agent_name)
+        dispatcher.reset(receiver, reader, agent_name)
+        return dispatcher
+
+    def reset(self, receiver: KQMLModule, reader: PooledKQMLReader,
+              agent_name: str):
+        """Rebinds this dispatcher, clearing the state of its last run.
+
+        Args:
+            receiver (KQMLModule): the agent messages are dispatched to
+            reader (PooledKQMLReader): the reader to dispatch messages from
+            agent_name (str): name of the agent
+        """
+        self.receiver = receiver
+        self.reader = reader
+        self.agent_name = agent_name
+        self.reply_continuations.clear()
+        self.shutdown_initiated = False
+
+    def release(self):
+        """Returns its reader and then this dispatcher to their pools"""
+        self.reader.release()
+        self.pool.append(self)
+
+
+def run_dispatcher(dispatcher: PooledKQMLDispatcher):
+    """Runs the dispatcher until its connection is done with and then returns
+    it (and its reader) to the pool. Releasing here (rather than in
+    receive_eof) makes sure the dispatcher being released is the one that has
+    stopped reading. However it stopped (eof, bad input, ...), its agent's
+    reference to it is cleared first - the pool is shared by every agent, so
+    once released it may be handed to another one.
+
+    Args:
+        dispatcher (PooledKQMLDispatcher): dispatcher reading from a
+            PooledKQMLReader
+    """
+    try:
+        dispatcher.start()
+    finally:
+        receiver = dispatcher.receiver
+        if receiver.dispatcher is dispatcher:
+            receiver.dispatcher = None
+        dispatcher.release()
+
+
+def send_buffer() -> BytesIO:
+    """Gets this thread's (emptied) buffer for serializing outgoing messages,
+    messages are sent from several threads so each gets its own.
+
+    Returns:
+        BytesIO
+    """
+    try:
+        buffer = SEND_BUFFERS.buffer
+    except AttributeError:
+        buffer = SEND_BUFFERS.buffer = BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+
 ###############################################################################
 #                  KQMLList & KQMLPerformative replacements                   #
 ###############################################################################
 
-# pylint: disable=too-many-return-statements
-# Eight is reasonable in this case, need to break down many data types.
 def listify(possible_list: Any) -> KQMLType:
     """Takes in an object and returns it in KQML form.
 
-    Checks if the input is a list, and if so it recurses through all entities
+    Checks if the input is a list, and if so it goes through all entities
     in the list to further listify them. If the input is not a list but is
     instead a tuple of length 2 we make the assumption that this is a dotted
     pair and construct the KQMLList as such, otherwise we treat this larger
@@ -601,6 +988,11 @@ def listify(possible_list: Any) -> KQMLType:
     input was nothing else we return the input as a string turned into a
     KQMLToken.
 
+    The type checks are dictionary lookups on the type (see LISTIFY_ITEMS and
+    LISTIFY_ATOMS) and nested lists are built with an explicit stack rather
+    than recursion, so deeply nested results are neither slow nor limited by
+    the recursion limit.
+
     Arguments:
         possible_list (Any): any input that you want to transform to KQML
             ready data types
@@ -608,29 +1000,115 @@ def listify(possible_list: Any) -> KQMLType:
     Returns:
         KQMLType
     """
-    if isinstance(possible_list, list):
-        new_list = [listify(each) for each in possible_list]
-        return KQMLList(new_list)
-    if isinstance(possible_list, tuple):
-        if len(possible_list) == 2:
-            car = listify(possible_list[0])
-            cdr = listify(possible_list[1])
-            return KQMLList([car, KQMLToken('.'), cdr])
-        new_list = [listify(each) for each in possible_list]
-        return KQMLList(new_list)
-    if isinstance(possible_list, str):
-        if ' ' in possible_list:
-            # WARNING: This may be an incomplete breakdown of strings.
-            if possible_list[0] == '(' and possible_list[-1] == ')':
-                terms = possible_list[1:-1].split()
-                return KQMLList([listify(t) for t in terms])
-            return KQMLString(possible_list)
-        return KQMLToken(possible_list)
-    if isinstance(possible_list, dict):
-        return KQMLList([listify(pair) for pair in possible_list.items()])
-    if isinstance(possible_list, bool):
-        return KQMLToken('t') if possible_list else KQMLToken('nil')
-    return KQMLToken(str(possible_list))
+    items = listify_items(possible_list)
+    if items is None:
+        return listify_atom(possible_list)
+    result = KQMLList()
+    stack = [(iter(items), result)]
+    while stack:
+        items, kqml_list = stack[-1]
+        for item in items:
+            sub_items = listify_items(item)
+            if sub_items is None:
+                kqml_list.data.append(listify_atom(item))
+            else:  # finish this sub list before continuing with this list
+                sub_list = KQMLList()
+                kqml_list.data.append(sub_list)
+                stack.append((iter(sub_items), sub_list))
+                break
+        else:
+            stack.pop()
+    return result
+
+
+def listify_items(possible_list: Any) -> Optional[Iterable]:
+    """The items to be listified into a KQMLList for lists, tuples (dotted
+    pairs), and dicts, None for anything else."""
+    get_items = LISTIFY_ITEMS.get(type(possible_list))
+    if get_items is not None:
+        return get_items(possible_list)
+    for list_type, get_items in LISTIFY_ITEMS.items():  # subclasses
+        if isinstance(possible_list, list_type):
+            return get_items(possible_list)
+    return None
+
+
+def listify_atom(possible_atom: Any) -> KQMLType:
+    """The KQML form of anything listify_items doesn't break down (strings,
+    bools, and everything else)."""
+    to_atom = LISTIFY_ATOMS.get(type(possible_atom))
+    if to_atom is not None:
+        return to_atom(possible_atom)
+    if isinstance(possible_atom, str):
+        return LISTIFY_ATOMS[str](possible_atom)
+    return token(str(possible_atom))
+
+
+@lru_cache(maxsize=4096)
+def token(string: str) -> KQMLToken:
+    """Shared KQMLToken for a string. The same few predicates, symbols and
+    numbers show up in message after message, so the tokens are cached rather
+    than created again for every message (bounded so arbitrary input can't
+    grow the cache without limit). Tokens are never modified once built.
+
+    Args:
+        string (str): the token's text
+
+    Returns:
+        KQMLToken
+    """
+    return KQMLToken(string)
+
+
+def listify_string(string: str) -> KQMLType:
+    """Listifies a string in one pass over its type: a KQMLToken if it has no
+    spaces, otherwise a KQMLList of the terms between the parens if it is in
+    lisp form (i.e. '(...)') or else a KQMLString. WARNING: This may be an
+    incomplete breakdown of strings.
+
+    Arguments:
+        string (str): the string to listify
+
+    Returns:
+        KQMLType
+    """
+    if ' ' not in string:
+        return token(string)
+    if string[0] == '(' and string[-1] == ')':
+        # split terms have no whitespace left in them, so they are tokens
+        lisp_list = KQMLList()
+        lisp_list.data = [token(term) for term in string[1:-1].split()]
+        return lisp_list
+    return KQMLString(string)
+
+
+LISTIFY_ITEMS = {
+    list: lambda items: items,
+    tuple: lambda items: ((items[0], DOT, items[1]) if len(items) == 2
+                          else items),
+    dict: lambda pairs: pairs.items(),
+}
+LISTIFY_ATOMS = {
+    str: listify_string,
+    bool: lambda boolean: TRUE if boolean else NIL,
+    KQMLToken: lambda token: token,
+}
+
+
+def is_variable(argument: KQMLType) -> bool:
+    """Whether a query argument is a variable (starts with '?'). Tokens, the
+    common case, are checked on their data directly rather than through
+    str().
+
+    Arguments:
+        argument (KQMLType): an argument from a query
+
+    Returns:
+        bool
+    """
+    if type(argument) is KQMLToken:  # pylint: disable=unidiomatic-typecheck
+        return argument.data[:1] == '?'
+    return str(argument[0]) == '?'
 
 
 def performative(string: str) -> KQMLPerformative:
@@ -646,6 +1124,23 @@ def performative(string: str) -> KQMLPerformative:
     return KQMLPerformative.from_string(string)
 
 
+def tell(sender: str, content: KQMLType) -> KQMLPerformative:
+    """Builds a tell performative directly from its parts, rather than
+    writing it out as a string to be parsed again by performative.
+
+    Arguments:
+        sender (str): name of the agent sending the tell
+        content (KQMLType): content of the tell
+
+    Returns:
+        KQMLPerformative: (tell :sender sender :content content)
+    """
+    message = KQMLPerformative('tell')
+    message.set('sender', token(sender))
+    message.set('content', content)
+    return message
+
+
 ###############################################################################
 #                         Lisp to Python style helpers                        #
 ###############################################################################
@@ -662,13 +1157,10 @@ def convert_to_boolean(to_be_bool: Any) -> bool:
     Returns:
         bool
     """
-    if isinstance(to_be_bool, KQMLToken) and to_be_bool.data == "nil":
-        return False
-    # pylint: disable=len-as-condition
-    # This is an issue that pylint is fixing in release 2.4.0.
-    # len(seq) == 0 is okay just len(seq) isn't.
-    if isinstance(to_be_bool, KQMLList) and len(to_be_bool) == 0:
-        return False
+    if isinstance(to_be_bool, KQMLToken):
+        return to_be_bool.data != 'nil'
+    if isinstance(to_be_bool, KQMLList):
+        return bool(to_be_bool.data)
     return True
 
 
@@ -683,9 +1175,7 @@ def convert_to_int(to_be_int: Any) -> int:
     Returns:
         int
     """
-    if isinstance(to_be_int, KQMLToken):
-        return int(to_be_int.data)
-    if isinstance(to_be_int, KQMLString):
+    if isinstance(to_be_int, (KQMLToken, KQMLString)):
         return int(to_be_int.data)
     return int(to_be_int)
 
@@ -694,9 +1184,11 @@ def convert_to_int(to_be_int: Any) -> int:
 #                 Argument parsing & port convenience helpers                 #
 ###############################################################################
 
+@lru_cache(maxsize=64)
 def valid_ip(string: str) -> str:
     """argparse type checking function for ip addresses. Valid if the ip
     address is either localhost or meets either of the ip4 or ip6 standards.
+    Valid addresses are cached, the same few hosts are checked over and over.
 
     Args:
         string (str): ip address as a string, usually passed in by arguments
@@ -708,9 +1200,10 @@ def valid_ip(string: str) -> str:
         ArgumentTypeError: If the ip address is not in the ip4 or ip6 format
             then this will fail as it is not a valid ip address for sockets
     """
-    if string in LOCALHOST_DEFS:
+    if string in LOCALHOST_DEFS or IPV4_PATTERN.fullmatch(string):
         return string
-    try:
+    from ipaddress import ip_address
+    try:  # ip6 (or something invalid)
         ip_address(string)
     except ValueError:
         raise ArgumentTypeError(f'{string} is not a valid host (ip address)')
@@ -734,18 +1227,126 @@ def valid_port(string: str) -> int:
     try:
         port_num = int(string)
     except ValueError:
-        raise ArgumentTypeError(f'{port_num} is not a valid port number')
-    in_range = 1024 < port_num < 65535
-    if not in_range:
+        raise ArgumentTypeError(f'{string!r} is not a valid port number')
+    if not 1024 <= port_num <= 65535:
         raise ArgumentTypeError(f'{port_num} is not a valid port number')
     return port_num
 
 
+def validated(validate: Callable[[Any], Any], value: Any,
+              message: str) -> Any:
+    """Runs one of the argparse type checking functions (valid_ip,
+    valid_port) outside of argparse. Raised rather than asserted, so the check
+    isn't skipped when running with python -O.
+
+    Args:
+        validate (Callable[[Any], Any]): the type checking function
+        value (Any): value to be checked
+        message (str): what was expected, for the error
+
+    Returns:
+        Any: the checked (and converted) value
+
+    Raises:
+        ValueError: the value didn't pass the check
+    """
+    try:
+        return validate(value)
+    except ArgumentTypeError as error:
+        raise ValueError(f'{message}: {error}') from None
+
+
+def disable_tcp_delays(connection: socket):
+    """Turns off Nagle's algorithm (and delayed acks where the platform
+    supports turning them off) on a TCP socket. Messages are small and written
+    in one piece, so there is nothing to gain by holding them back.
+
+    Args:
+        connection (socket): connected TCP socket
+    """
+    connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    if TCP_QUICKACK is not None:
+        connection.setsockopt(IPPROTO_TCP, TCP_QUICKACK, 1)
+
+
+def port_only_argument(args: list) -> Optional[int]:
+    """Fast path for command line arguments that are only a port, i.e.
+    ['-p', port], ['--port', port], or ['--port=port']. Anything else
+    (including an invalid port) is left for ArgumentParser to handle.
+
+    Args:
+        args (list): argument list, without the name of the file
+
+    Returns:
+        Optional[int]: the port, if that was the only argument
+    """
+    if len(args) == 2 and args[0] in ('-p', '--port'):
+        port = args[1]
+    elif len(args) == 1 and args[0].startswith('--port='):
+        port = args[0][len('--port='):]
+    else:
+        return None
+    try:
+        return valid_port(port)
+    except ArgumentTypeError:
+        return None
+
+
 def check_for_companions(verify: bool = False) -> Optional[int]:
     """A helper function that will check for a running companions executable
     OR for the allegro development environment (plus a qrg directory) and
     try to get it's port number from the port dictionary it creates in
-    portnum.dat
+    portnum.dat. Unverified results are cached for COMPANIONS_CACHE_TTL
+    seconds so that back to back calls (e.g. starting several agents) only
+    search the system once, use check_for_companions.cache_clear() to force a
+    new search (of every running process, see clear_companions_cache).
+    Verified calls always search, the point is to check the process that is
+    running now.
+
+    Args:
+        verify (bool, optional): whether or not to verify that the companions
+            process being looked at has the same pid as the one stored in it's
+            port_dict
+
+    Returns:
+        Optional[int]: portnum of a running process (if found)
+    """
+    if verify:
+        return search_for_companions(verify)
+    now = monotonic()
+    cached = COMPANIONS_CACHE.get('port')
+    if cached and now - cached[0] < COMPANIONS_CACHE_TTL:
+        return cached[1]
+    port = search_for_companions(verify)
+    COMPANIONS_CACHE['port'] = (now, port)
+    return port
+
+
+def clear_companions_cache():
+    """Clears the cached check_for_companions result and the recorded
+    portnum.dat location (see recorded_port), so that the next check searches
+    every running process again. Available as
+    check_for_companions.cache_clear.
+    """
+    COMPANIONS_CACHE.clear()
+    try:
+        (Path.home() / PORTNUM_PATH_CACHE).unlink()
+    except OSError:  # nothing recorded (yet)
+        pass
+
+
+check_for_companions.cache_clear = clear_companions_cache
+
+
+def search_for_companions(verify: bool = False) -> Optional[int]:
+    """A helper function that will check for a running companions executable
+    OR for the allegro development environment (plus a qrg directory) and
+    try to get it's port number from the port dictionary it creates in
+    portnum.dat. Uncached version of check_for_companions. The portnum.dat
+    the last companion was found through is checked first, if the process
+    that wrote it is still running and is the highest priority executable
+    (nothing else found could outrank it) there is no need to go through
+    every running process.
 
     Args:
         verify (bool, optional): whether or not to verify that the companions
@@ -756,42 +1357,309 @@ def check_for_companions(verify: bool = False) -> Optional[int]:
         Optional[int]: portnum of a running process (if found)
     """
     LOGGER.debug('Checking for companions...')
-    potential_port = None
-    processes = process_iter(attrs=['pid', 'name', 'exe'])
-    # search for running companions executables
-    companion = None
-    for name in COMPANIONS_EXES:
-        process = next((p.info for p in processes if name in p.info['name']),
-                       None)  # default value returned if no process found.
-        if process:
-            companion = process
-            break
+    potential_port = recorded_port()
+    if potential_port:
+        return potential_port
+    # one pass over the running processes for every name we care about
+    found = find_named_processes(
+        COMPANIONS_NAMES, named_processes(COMPANIONS_NAMES, COMPANIONS_COMMS))
+    # search for running companions executables (in priority order)
+    companion = next((found[name] for name in COMPANIONS_EXES
+                      if name in found), None)
     if companion:
-        portnum_path = Path(companion['exe']).with_name(PORTNUM)
-        potential_port = get_port(portnum_path, companion['pid'], verify)
+        companion = companion._replace(exe=process_exe(companion.pid))
+    if companion and companion.exe:
+        portnum_path = Path(companion.exe).with_name(PORTNUM)
+        potential_port = get_port(portnum_path, companion.pid, verify)
     if potential_port:
+        record_portnum_path(portnum_path)
         return potential_port
-    # search for the qrg directory (in default locations) and a running allegro
-    # executable -> doesn't always mean that companions is running
-    qrg_root = None
-    potential_roots = [Path(disk.mountpoint) for disk in disk_partitions()]
-    potential_roots.append(Path.home())
-    for root in potential_roots:
-        qrg = root / 'qrg'
-        if qrg.exists():
-            qrg_root = qrg
-            break
-    # allegro = _find_named_process('allegro.exe', processes)
-    allegro = next((p.info for p in processes
-                    if 'allegro.exe' in p.info['name']), None)
-    if qrg_root and allegro:
+    # search for a running allegro executable and the qrg directory (in
+    # default locations) -> doesn't always mean that companions is running
+    allegro = found.get('allegro.exe')
+    if not allegro:  # no need to search the drives for a qrg directory
+        return None
+    qrg_root = find_qrg_root()
+    if qrg_root:
         portnum_path = qrg_root / 'companions' / 'v1' / PORTNUM
-        potential_port = get_port(portnum_path, allegro['pid'], verify)
+        potential_port = get_port(portnum_path, allegro.pid, verify)
+        if potential_port:
+            record_portnum_path(portnum_path)
     # Could have not found anything, in this case we return None by nature of
     # potential_port not having had a new value assigned
     return potential_port
 
 
+def recorded_port() -> Optional[int]:
+    """Gets the port from the portnum.dat file recorded by the last search
+    (see PORTNUM_PATH_CACHE), as long as the process that wrote it is still
+    running as the highest priority companions executable (the first of
+    COMPANIONS_EXES). A lower priority companion (or allegro) may have been
+    outranked since it was recorded, so it isn't trusted without a search.
+
+    Returns:
+        Optional[int]: port number of the recorded companion (if still
+            running and nothing could outrank it)
+    """
+    try:
+        portnum_path = (Path.home() / PORTNUM_PATH_CACHE).read_text().strip()
+        port_dict = read_port_dict(portnum_path)
+    except (OSError, ValueError):  # nothing recorded (yet) or a bad file
+        return None
+    if not port_dict or 'port' not in port_dict or 'pid' not in port_dict:
+        return None
+    if not is_named_process(port_dict['pid'], COMPANIONS_EXES[0]):
+        return None
+    return port_dict['port']
+
+
+def record_portnum_path(portnum_path: Path):
+    """Records where the portnum.dat file of a running companion was found,
+    to be checked first next time (see recorded_port).
+
+    Args:
+        portnum_path (Path): path to the portnum.dat file
+    """
+    cache_path = Path.home() / PORTNUM_PATH_CACHE
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(str(portnum_path))
+    except OSError as error_msg:
+        LOGGER.debug('Could not cache portnum path: %s', error_msg)
+
+
+def find_qrg_root() -> Optional[Path]:
+    """Searches for the qrg directory at the root of every drive/ partition,
+    and then the home directory, returning the first one found. The directory
+    found is cached (in the home directory, see QRG_ROOT_CACHE) and, as long
+    as it still holds companions, reused on later runs without searching.
+    Setting the QRG_ROOT (or COMPANIONS_HOME) environment variable to the qrg
+    directory skips the search altogether.
+
+    Returns:
+        Optional[Path]: path to the qrg directory (if found)
+    """
+    for variable in QRG_ROOT_VARIABLES:
+        configured = environ.get(variable)
+        if configured and isdir(join_path(configured, 'companions', 'v1')):
+            return Path(configured)
+    cache_path = Path.home() / QRG_ROOT_CACHE
+    try:
+        cached = cache_path.read_text().strip()
+        if isdir(join_path(cached, 'companions', 'v1')):
+            return Path(cached)
+    except OSError:  # nothing cached (yet)
+        pass
+    # plain strings and os.path, a Path is only made for the one found
+    potential_roots = mount_points()
+    potential_roots.append(str(Path.home()))
+    for root in potential_roots:
+        qrg = join_path(root, 'qrg')
+        if isdir(qrg):
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                cache_path.write_text(qrg)
+            except OSError as error_msg:
+                LOGGER.debug('Could not cache qrg directory: %s', error_msg)
+            return Path(qrg)
+    return None
+
+
+def mount_points() -> list:
+    """Lists the roots of the mounted drives/ partitions on this system. Reads
+    /proc/mounts on linux and the GetLogicalDrives bitmask on windows (neither
+    stat the drives the way psutil's disk_partitions does, which can stall on
+    network drives), falling back on disk_partitions elsewhere. Only disks
+    are listed: fixed and removable drives on windows, and on linux mounts of
+    device backed filesystems (no proc, sysfs, tmpfs, nfs, etc) plus /, which
+    is often an overlay in containers.
+
+    Returns:
+        list: mount points as strings
+    """
+    if platform == 'win32':
+        from ctypes import windll
+        kernel32 = windll.kernel32
+        drives = kernel32.GetLogicalDrives()
+        roots = [f'{letter}:\\' for index, letter in enumerate(ascii_uppercase)
+                 if drives & (1 << index)]
+        return [root for root in roots
+                if kernel32.GetDriveTypeW(root) in DISK_DRIVE_TYPES]
+    try:
+        with open('/proc/filesystems') as filesystems_file:
+            # filesystems that aren't backed by a device are marked nodev
+            virtual_filesystems = {line.split()[-1]
+                                   for line in filesystems_file
+                                   if line.startswith('nodev')}
+        roots = ['/']
+        with open('/proc/mounts') as mounts_file:
+            for line in mounts_file:
+                _, mount_point, filesystem, *_ = line.split()
+                if filesystem in virtual_filesystems:
+                    continue
+                # spaces (etc) in mount points are octal escaped, i.e. \040
+                mount_point = OCTAL_ESCAPE.sub(
+                    lambda escape: chr(int(escape[1], 8)), mount_point)
+                if mount_point not in roots:
+                    roots.append(mount_point)
+        return roots
+    except FileNotFoundError:
+        from psutil import disk_partitions
+        return [disk.mountpoint for disk in disk_partitions()]
+
+
+class ProcInfo(NamedTuple):
+    """The process information check_for_companions needs about a running
+    process.
+
+    Attributes:
+        pid (int): the process id
+        name (str): the process name
+        exe (Optional[str]): path to the executable, only resolved for the
+            process that is used (see process_exe)
+    """
+
+    pid: int
+    name: str
+    exe: Optional[str] = None
+
+
+def named_processes(names: dict, comms: dict) -> Iterator[ProcInfo]:
+    """Yields the running processes (as ProcInfo) that may be one
+    of the named processes. On linux this reads /proc directly, checking only
+    the (cheap) comm file of each process - psutil's process_iter would
+    otherwise run a pid reuse check for every process on the system.
+    Elsewhere we fall back on psutil (which, since 6.0, doesn't check every
+    process for pid reuse either). The exe is left out either way, resolving
+    it is a readlink (or worse) per process, see process_exe.
+
+    Args:
+        names (dict): lowercased process names you are searching for -> name
+            (see COMPANIONS_NAMES)
+        comms (dict): the same names as they appear in /proc/<pid>/comm,
+            lowercased and truncated to 15 characters -> name (see
+            COMPANIONS_COMMS)
+
+    Yields:
+        ProcInfo: the process (pid and name)
+    """
+    if not platform.startswith('linux'):
+        from psutil import process_iter
+        for process in process_iter(attrs=['pid', 'name']):
+            name = process.info['name']
+            # None when access is denied
+            if name is not None and name.lower() in names:
+                yield ProcInfo(process.info['pid'], name)
+        return
+    # listdir rather than scandir, only the names are needed
+    for pid in listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        comm = process_comm(pid)
+        if comm is None:  # process exited or is not ours to read
+            continue
+        name = comms.get(comm.lower())
+        if name is not None:
+            yield ProcInfo(int(pid), name)
+
+
+def process_comm(pid: Any) -> Optional[str]:
+    """Reads the name (comm) of a process from /proc (linux only), with a
+    single raw read - no text io layers for a 16 byte file.
+
+    Args:
+        pid (Any): pid of the process (int or the /proc directory name)
+
+    Returns:
+        Optional[str]: name of the process, None if it can't be read
+    """
+    try:
+        comm_fd = open_fd(f'/proc/{pid}/comm', O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return read(comm_fd, 64).rstrip(b'\n').decode(errors='replace')
+    except OSError:
+        return None
+    finally:
+        close(comm_fd)
+
+
+def process_exe(pid: int) -> Optional[str]:
+    """Gets the path to the executable of the process with the given pid.
+
+    Args:
+        pid (int): pid of the process
+
+    Returns:
+        Optional[str]: path to the executable, None if it can't be read
+    """
+    if platform.startswith('linux'):
+        try:
+            return readlink(f'/proc/{pid}/exe')
+        except OSError:
+            return None
+    from psutil import Process, Error
+    try:
+        return Process(pid).exe() or None
+    except Error:
+        return None
+
+
+def is_named_process(pid: int, name: str) -> bool:
+    """Whether the process with the given pid is running under the given
+    name (compared case insensitively). A single lookup, rather than a pass
+    over every running process.
+
+    Args:
+        pid (int): pid of the process
+        name (str): process name to check for
+
+    Returns:
+        bool
+    """
+    if platform.startswith('linux'):
+        comm = process_comm(pid)
+        if comm is None:  # not running (or not ours to read)
+            return False
+        # the kernel truncates comm to 15 characters (TASK_COMM_LEN - 1)
+        return comm.lower() == name[:15].lower()
+    from psutil import Process, Error
+    try:
+        return Process(pid).name().lower() == name.lower()
+    except Error:
+        return False
+
+
+def find_named_processes(names: dict,
+                         processes: Iterable[ProcInfo]) -> dict:
+    """Searches for all of the named processes in a single pass over the
+    running processes, keeping the first process found for each name and
+    stopping as soon as every name has been found.
+
+    Args:
+        names (dict): lowercased process names you are searching for -> name
+            (see COMPANIONS_NAMES)
+        processes (Iterable[ProcInfo]): processes to be searched over,
+            consumed lazily
+
+    Returns:
+        dict: the process (ProcInfo) found for each name
+    """
+    # exact (case insensitive, as on windows) rather than substring matches
+    found = {}
+    for process in processes:
+        name = process.name
+        if name is None:  # psutil gives None when access is denied
+            continue
+        name = names.get(name.lower())
+        if name is not None and name not in found:
+            found[name] = process
+            if len(found) == len(names):
+                break
+    return found
+
+
 def get_port(portnum_path: Path, process_pid: int,
              verify: bool = False) -> Optional[int]:
     """Gets the port number from the portnum.dat file as a dict. If verify is
@@ -812,13 +1680,208 @@ def get_port(portnum_path: Path, process_pid: int,
          Optional[int]: port number found in port_dict (or None if not found,
             or not valid)
     """
-    if portnum_path.exists():
-        with portnum_path.open() as portnum_file:
-            port_dict = load_dict(portnum_file.readline())
-        if 'port' not in port_dict:
-            return None
-        if verify:
-            assert 'pid' in port_dict
-            assert process_pid == port_dict['pid']
-        return port_dict['port']
-    return None
+    try:
+        port_dict = read_port_dict(str(portnum_path))
+    except FileNotFoundError:
+        return None
+    if 'port' not in port_dict:
+        return None
+    if verify:
+        assert 'pid' in port_dict
+        assert process_pid == port_dict['pid']
+    return port_dict['port']
+
+
+def read_port_dict(portnum_path: str) -> dict:
+    """Reads the port dictionary (keys pid and port) from a portnum.dat file.
+    Companions only writes the file when it starts, so the dictionary is
+    cached (see PORT_DICT_CACHE) and while the file is unchanged - same
+    inode, modification time and size - only a stat is needed.
+
+    Args:
+        portnum_path (str): path to the portnum.dat file
+
+    Returns:
+        dict: the port dictionary (shared, don't modify it)
+    """
+    stats = stat(portnum_path)
+    file_key = (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+    cached = PORT_DICT_CACHE.get(portnum_path)
+    if cached and cached[0] == file_key:
+        return cached[1]
+    port_dict = parse_port_dict(portnum_path)
+    PORT_DICT_CACHE[portnum_path] = (file_key, port_dict)
+    return port_dict
+
+
+def parse_port_dict(portnum_path: str) -> dict:
+    """Reads and parses the port dictionary from a portnum.dat file, uncached
+    version of read_port_dict.
+
+    Args:
+        portnum_path (str): path to the portnum.dat file
+
+    Returns:
+        dict: the port dictionary
+    """
+    portnum_fd = open_fd(portnum_path, O_RDONLY)
+    # a short ascii json line, read the raw bytes without any text io layers
+    try:
+        data = read(portnum_fd, 256)
+    finally:
+        close(portnum_fd)
+    line = data.split(b'\n', 1)[0]
+    if PORTNUM_FIELDS is not None:
+        port_dict = {key.decode(): int(value)
+                     for key, value in PORTNUM_FIELDS.findall(line)}
+        if 'port' in port_dict:
+            return port_dict
+    return load_dict(line)
+
+
+class FileWatch:
+    """Watches for a file to be written. Created (armed) before whatever is
+    going to write the file is started, so the write can't be missed. On linux
+    this sleeps on an inotify watch of the parent directory (waking as soon as
+    the file is closed after writing or moved into place), on windows on a
+    change notification for the directory, otherwise - or if the watch can't
+    be set up - it falls back to polling for the file.
+
+    Attributes:
+        change_handle (int): windows change notification handle (or None)
+        file_path (Path): the file being waited on
+        poll_interval (float): seconds between checks when polling
+        watch_fd (int): inotify file descriptor (or None)
+    """
+
+    def __init__(self, file_path: Path, poll_interval: float = 0.05):
+        """Arms the watch on the parent directory of file_path
+
+        Args:
+            file_path (Path): the file to wait for
+            poll_interval (float, optional): seconds between checks when
+                polling
+        """
+        self.file_path = file_path
+        self.poll_interval = poll_interval
+        self.watch_fd = _inotify_watch(file_path.parent)
+        self.change_handle = None
+        if self.watch_fd is None:
+            self.change_handle = _change_notification(file_path.parent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until the file has been written (or the timeout passes).
+
+        Args:
+            timeout (float, optional): seconds to wait for, forever if None
+
+        Returns:
+            bool: whether the file was written (False on timeout)
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        file_path = str(self.file_path)  # os.path, not Path, when polling
+        # the file may have been written before we got here
+        if path_exists(file_path):
+            return True
+        while True:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self.watch_fd is not None:
+                if not select([self.watch_fd], [], [], remaining)[0]:
+                    return False
+                if self.file_path.name in _read_inotify_names(self.watch_fd):
+                    return True
+                continue
+            if self.change_handle is not None:
+                if not _wait_for_change(self.change_handle, remaining):
+                    return False
+            else:
+                sleep(self.poll_interval if remaining is None
+                      else min(self.poll_interval, remaining))
+            if path_exists(file_path):
+                return True
+
+    def close(self):
+        """Closes the watch (if any)"""
+        if self.watch_fd is not None:
+            close(self.watch_fd)
+            self.watch_fd = None
+        if self.change_handle is not None:
+            from ctypes import windll, c_void_p
+            windll.kernel32.FindCloseChangeNotification(
+                c_void_p(self.change_handle))
+            self.change_handle = None
+
+
+def _inotify_watch(directory: Path) -> Optional[int]:
+    """Opens an inotify file descriptor watching directory for files being
+    written or moved in. Returns None if inotify is unavailable."""
+    if not platform.startswith('linux'):
+        return None
+    from ctypes import CDLL
+    from ctypes.util import find_library
+    try:
+        libc = CDLL(find_library('c'), use_errno=True)
+        watch_fd = libc.inotify_init1(IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if watch_fd < 0:
+        return None
+    if libc.inotify_add_watch(watch_fd, fsencode(directory),
+                              IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        close(watch_fd)
+        return None
+    return watch_fd
+
+
+def _change_notification(directory: Path) -> Optional[int]:
+    """Opens a windows change notification handle for files being created,
+    renamed or written in directory. Returns None if not on windows or the
+    handle can't be opened."""
+    if platform != 'win32':
+        return None
+    from ctypes import windll, c_void_p
+    find_first = windll.kernel32.FindFirstChangeNotificationW
+    find_first.restype = c_void_p
+    handle = find_first(str(directory), False,
+                        FILE_NOTIFY_CHANGE_FILE_NAME |
+                        FILE_NOTIFY_CHANGE_LAST_WRITE)
+    if handle in (None, c_void_p(-1).value):  # INVALID_HANDLE_VALUE
+        return None
+    return handle
+
+
+def _wait_for_change(change_handle: int, timeout: Optional[float]) -> bool:
+    """Blocks until the next change notification (or the timeout passes) and
+    re-arms the handle for the next one."""
+    from ctypes import windll, c_void_p, c_ulong
+    kernel32 = windll.kernel32
+    milliseconds = INFINITE if timeout is None else int(timeout * 1000)
+    if kernel32.WaitForSingleObject(c_void_p(change_handle),
+                                    c_ulong(milliseconds)) != WAIT_OBJECT_0:
+        return False
+    kernel32.FindNextChangeNotification(c_void_p(change_handle))
+    return True
+
+
+def _read_inotify_names(watch_fd: int) -> list:
+    """Blocks for the next batch of inotify events and returns the file names
+    they refer to (decoded as the filesystem does, any name can show up in
+    the directory)."""
+    events = read(watch_fd, 4096)
+    names = []
+    offset = 0
+    while offset < len(events):
+        # struct inotify_event: int wd; uint32 mask, cookie, len; char name[]
+        *_, name_len = unpack_from('iIII', events, offset)
+        offset += 16
+        names.append(fsdecode(events[offset:offset + name_len].rstrip(b'\0')))
+        offset += name_len
+    return names
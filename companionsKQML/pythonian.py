@@ -22,7 +22,8 @@ from time import sleep
 from traceback import print_exc
 from typing import Any, Callable
 from kqml import KQMLPerformative, KQMLList
-from .companionsKQMLModule import CompanionsKQMLModule, listify, performative
+from .companionsKQMLModule import CompanionsKQMLModule, listify, \
+     performative, tell, token
 
 LOGGER = getLogger(__name__)
 
@@ -83,8 +84,7 @@ class Pythonian(CompanionsKQMLModule):
             content (KQMLList): tell content from companions to be logged
         """
         LOGGER.debug('received tell: %s', content)
-        reply_msg = performative(f'(tell :sender {self.name} :content :ok)')
-        self.reply(msg, reply_msg)
+        self.reply(msg, tell(self.name, token(':ok')))
 
     ###########################################################################
     #                            Ask-one Functions                            #
@@ -242,9 +242,7 @@ class Pythonian(CompanionsKQMLModule):
             self.error_reply(msg, error_msg)
             return
         LOGGER.debug('Acheive returned results: %s', results)
-        reply = performative(f'(tell :sender {self.name} :content '
-                             f'{listify(results)})')
-        self.reply(msg, reply)
+        self.reply(msg, tell(self.name, listify(results)))
 
     ###########################################################################
     #                          Subscription Functions                         #
@@ -357,8 +355,7 @@ class Pythonian(CompanionsKQMLModule):
             return
         LOGGER.info('received subscription %s to %s', msg, pattern)
         self.subscriptions.subscribe(pattern, msg)
-        reply_msg = f'(tell :sender {self.name} :content :ok)'
-        self.reply(msg, performative(reply_msg))
+        self.reply(msg, tell(self.name, token(':ok')))
 
     def poll_for_subscription_updates(self):
         """Goes through the subscription updates as they come in and properly
@@ -10,7 +10,7 @@ setup(name='companionsKQML',
       version='1.1',
       packages=['companionsKQML'],
       python_requires='>=3.0',
-      install_requires=['pykqml>=1.1', 'psutil>=5.6.5',
+      install_requires=['pykqml>=1.1', 'psutil>=6.0',
                         'python-dateutil>=2.8.1'],
       url='http://github.com/SamuelHill/companionsKQML',
       author='Samuel J. Hill',